@@ -1,17 +1,34 @@
+import asyncio
 import logging
+from concurrent.futures import ProcessPoolExecutor
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import aiohttp
+import aiohttp_client_cache
+import requests_cache
+import lxml.html
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
 import datetime
-from bs4 import BeautifulSoup
+import heapq
 import os
-import glob
 
-# Configure logging settings
+# Configure logging settings; callers enqueue records and a background
+# listener owns the file handler, keeping write() syscalls off the hot path
 log_format = "%(asctime)s [%(levelname)s] - %(message)s"
-logging.basicConfig(
-    level=logging.INFO, filename="data_extraction.log", filemode="a", format=log_format
-)
+log_queue = queue.SimpleQueue()
+file_handler = logging.FileHandler("data_extraction.log", mode="a")
+file_handler.setFormatter(logging.Formatter(log_format))
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, file_handler)
+log_listener.start()
 
 # Define file paths and URLs
 kml_path = "https://onemotoring.lta.gov.sg/mapapp/kml/erp-kml/erp-kml-0.kml"
@@ -19,51 +36,95 @@ link = "https://datamall.lta.gov.sg/mapapp/pages/ddls/1_ddl.html"
 data_directory = "data"  # Directory to store data files
 toll_pattern = "toll-rates"
 markers_pattern = "markers"
+# Also export a CSV copy of each artifact for human consumption
+export_csv = os.environ.get("EXPORT_CSV", "").lower() in ("1", "true")
+# Cache HTTP responses between runs; set HTTP_CACHE=0 to force fresh fetches (e.g. in CI)
+use_http_cache = os.environ.get("HTTP_CACHE", "1").lower() not in ("0", "false")
+http_cache_path = os.path.join(data_directory, "http_cache")
+
+if use_http_cache:
+    os.makedirs(data_directory, exist_ok=True)
+    http_session = requests_cache.CachedSession(
+        http_cache_path, backend="sqlite", expire_after=3600
+    )
+else:
+    http_session = requests.Session()
+
+# Pool and reuse connections instead of a fresh TCP+TLS handshake per request
+http_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    ),
+)
+
+# Precompiled regex patterns for KML parsing; ENTRY_RE captures the marker
+# name and its longitude/latitude pair in a single streaming pass
+ENTRY_RE = re.compile(
+    r"<td>([^<]+)</td>.*?<coordinates>\s*([^,]+),([^,]+),[^<]+</coordinates>",
+    re.DOTALL,
+)
+ID_RE = re.compile(r"\((\d+)\)$")
+CAT_RE = re.compile(r"^\s*([^(]+?)\s*\(\s*(.+?)\s*\)\s*$")
+
+# Explicit column dtypes for the stored artifacts, so comparison works on
+# typed arrays instead of inferred object columns
+MARKERS_DTYPE = {"Longitude": "float64", "Latitude": "float64", "id": "int32"}
+TOLL_DTYPE = {"rates": "float32"}
 
-def extract_plaza_info_from_kml(kml_path):
+# Toll frames at least this large are diffed per plaza across a process pool
+PARALLEL_DIFF_MIN_ROWS = 10_000
+
+# Key columns identifying a row across snapshots, per file kind
+KIND_KEYS = {
+    "markers": ["id"],
+    "toll": ["plaza_name", "vehicle_cat", "time", "weekdays/weekends"],
+}
+
+def extract_plaza_info_from_kml(kml_path, today_date):
     """
     Extract data from a KML file and perform preprocessing.
 
-    Args: 
+    Args:
         kml_path (str): URL to the KML file.
+        today_date (str): Date stamp (YYYY-MM-DD) for the output file.
 
     Returns:
         pandas.DataFrame: Extracted and processed data.
     """
     try:
         logging.info("Fetching data from KML file.")
-        response = requests.get(kml_path)
+        response = http_session.get(kml_path, timeout=10)
         response.raise_for_status()
 
         data = response.text
-        name_pattern = r"<td>([^<]+)</td>"
-        coordinates_pattern = r"<coordinates>\s*([^<]+)\s*</coordinates>"
-        name_matches = re.findall(name_pattern, data)
-        coordinates_matches = re.findall(coordinates_pattern, data)
-
-        if len(name_matches) == len(coordinates_matches):
-            data_list = []
-            for name, coordinates in zip(name_matches, coordinates_matches):
-                longitude, latitude, _ = coordinates.split(",")
-
-                longitude = round(float(longitude.strip()), 7)
-                latitude = round(float(latitude.strip()), 7)
-                data_list.append([name.strip(), longitude, latitude])
-
-            df = pd.DataFrame(data_list, columns=["Name", "Longitude", "Latitude"])
-            df["id"] = df["Name"].str.extract(r"\((\d+)\)$")
-
-            today_date = datetime.datetime.now().strftime("%Y-%m-%d")
-            log_file_path = os.path.join(data_directory, f"markers-{today_date}.csv")
-            logging.info(f"Saving data to {log_file_path}")
-            df.to_csv(log_file_path, index=False)
+        df = pd.DataFrame.from_records(
+            (match.groups() for match in ENTRY_RE.finditer(data)),
+            columns=["Name", "Longitude", "Latitude"],
+        )
 
-            return df
-        else:
-            raise Exception(
-                "Number of names and coordinates don't match. Data extraction failed."
+        if df.empty:
+            raise Exception("No markers found in KML file. Data extraction failed.")
+
+        df["Name"] = df["Name"].str.strip()
+        df["Longitude"] = df["Longitude"].astype("float64").round(7)
+        df["Latitude"] = df["Latitude"].astype("float64").round(7)
+        df["id"] = df["Name"].str.extract(ID_RE)
+        df = df.astype(MARKERS_DTYPE)
+
+        log_file_path = os.path.join(data_directory, f"markers-{today_date}.parquet")
+        logging.info(f"Saving data to {log_file_path}")
+        df.to_parquet(log_file_path, compression="zstd", index=False)
+        if export_csv:
+            pa.csv.write_csv(
+                pa.Table.from_pandas(df, preserve_index=False),
+                os.path.join(data_directory, f"markers-{today_date}.csv"),
             )
 
+        return df
+
     except requests.exceptions.RequestException as e:
         logging.error(f"Failed to fetch data from the URL: {e}")
         raise Exception(f"Failed to fetch data from the URL: {e}")
@@ -82,12 +143,9 @@ def categ_dict(df, link):
     """
     try:
         id_name = dict(zip(df.id, df.Name))
-        category_content = requests.get(link).text
-        cat_soup = BeautifulSoup(category_content, "lxml")
-        categories = cat_soup.find("select", {"class": "selectstyle"})
-        cat_text = categories.get_text()
-        cat_list = list(cat_text.split("\n"))
-        cat_list = cat_list[1::]
+        category_content = http_session.get(link, timeout=10).text
+        cat_tree = lxml.html.fromstring(category_content)
+        cat_list = cat_tree.xpath("//select[@class='selectstyle']/option/text()")
         cat_id = [0, 1, 2, 3, 4, 5, 6, 7]
         cat_dict = dict(zip(cat_id, cat_list))
         logging.info("Category dictionary created.")
@@ -97,147 +155,247 @@ def categ_dict(df, link):
         raise
     
 
-def get_data(df, id_name, cat_dict):
+async def fetch_rate_page(session, plaza_id, cat_id):
+    """
+    Fetch a single toll rate page for a plaza and vehicle category.
+
+    Args:
+        session (aiohttp.ClientSession): Shared HTTP session.
+        plaza_id (str): Plaza ID.
+        cat_id (int): Vehicle category ID.
+
+    Returns:
+        tuple: Tuple of (plaza_id, cat_id, html_content).
     """
-    Fetch and process toll data from web sources and save to CSV.
+    link = f"https://datamall.lta.gov.sg/mapapp/pages/tables/{plaza_id}_table_{cat_id}.html"
+    async with session.get(link) as response:
+        return plaza_id, cat_id, await response.text()
+
+
+async def fetch_all_rate_pages(plaza_ids):
+    """
+    Fetch all toll rate pages for all plazas and categories concurrently.
+
+    Args:
+        plaza_ids (iterable): Plaza IDs to fetch pages for.
+
+    Returns:
+        list: Results of each fetch, either (plaza_id, cat_id, html_content)
+            tuples or the exception raised by the failed fetch.
+    """
+    connector = aiohttp.TCPConnector(limit=64, keepalive_timeout=30)
+    if use_http_cache:
+        client = aiohttp_client_cache.CachedSession(
+            cache=aiohttp_client_cache.SQLiteBackend(
+                f"{http_cache_path}-aio", expire_after=3600
+            ),
+            connector=connector,
+        )
+    else:
+        client = aiohttp.ClientSession(connector=connector)
+
+    async with client as session:
+        tasks = [
+            fetch_rate_page(session, i, j) for i in plaza_ids for j in range(8)
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_data(df, id_name, cat_dict, today_date):
+    """
+    Fetch and process toll data from web sources and save to Parquet
+    (plus a CSV copy when EXPORT_CSV is set).
 
     Args:
         df (pandas.DataFrame): Dataframe containing plaza information data.
         id_name (dict): ID name to place mapping.
         cat_dict (dict): Category mapping.
+        today_date (str): Date stamp (YYYY-MM-DD) for the output file.
     """
-    df_final = pd.DataFrame()
-
-    for i in df.id:
-        data_to_concat = []
-
-        for j in range(8):
-            link = f"https://datamall.lta.gov.sg/mapapp/pages/tables/{i}_table_{j}.html"
-            try:
-                html_content = requests.get(link).text
-                soup = BeautifulSoup(html_content, "lxml")
-                rate_table = soup.find("table", {"class": "styler"})
-
-                if len(rate_table) != 3:
-                    rows_data = []
-
-                    for row in rate_table.find_all("tr"):
-                        columns = row.find_all("td")
-
-                        place = i
-                        days = j
-                        time = columns[0].text.strip()
-                        rates = columns[1].text.strip().replace("$", "")
-
-                        rows_data.append(
-                            {
-                                "plaza_name": place,
-                                "vehicle_cat": days,
-                                "time": time,
-                                "rates": rates,
-                            }
-                        )
-
-                    df_temp = pd.DataFrame(rows_data)
-                    df_temp = df_temp.replace(
-                        {"plaza_name": id_name, "vehicle_cat": cat_dict}
-                    )
-                    df_temp["rates"] = pd.to_numeric(df_temp["rates"], errors="coerce")
-                    data_to_concat.append(df_temp)
-            except requests.exceptions.RequestException as e:
-                logging.warning(f"Failed to fetch data from URL {link}: {e}")
-                # Log the error and continue gracefully
-
-        if data_to_concat:
-            df_final = pd.concat([df_final] + data_to_concat, ignore_index=True)
-            # logging.info(f"Data concatenated and appended to df_final for plaza_id {i}")
+    rows_data = []
+
+    results = asyncio.run(fetch_all_rate_pages(df.id))
+
+    for result in results:
+        if isinstance(result, Exception):
+            logging.warning(f"Failed to fetch toll data: {result}")
+            # Log the error and continue gracefully
+            continue
+
+        i, j, html_content = result
+        tree = lxml.html.fromstring(html_content)
+        rows = tree.xpath(".//table[contains(@class, 'styler')]//tr")
+
+        if not rows:
+            continue
+
+        place = id_name.get(i, i)
+        days = cat_dict.get(j, j)
+
+        for row in rows:
+            columns = row.xpath("./td/text()")
+
+            # no-data and malformed rows carry fewer than two td text nodes
+            if len(columns) < 2:
+                continue
+
+            time = columns[0].strip()
+            rates = columns[1].strip().replace("$", "")
+
+            rows_data.append((place, days, time, rates))
+
+    df_final = pd.DataFrame(
+        rows_data, columns=["plaza_name", "vehicle_cat", "time", "rates"]
+    )
+    df_final["rates"] = pd.to_numeric(df_final["rates"], errors="coerce")
+    df_final = df_final.astype(TOLL_DTYPE)
 
     if not df_final.empty:
-        df_final[["vehicle_cat", "weekdays/weekends"]] = df_final[
-            "vehicle_cat"
-        ].str.split("(", expand=True)
-        df_final["weekdays/weekends"] = df_final["weekdays/weekends"].str.replace(
-            ")", ""
-        )
+        extracted = df_final["vehicle_cat"].str.extract(CAT_RE)
+        df_final["vehicle_cat"] = extracted[0]
+        df_final["weekdays/weekends"] = extracted[1]
 
-        today_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        log_file_path = os.path.join(data_directory, f"toll-rates-{today_date}.csv")
-        df_final.to_csv(
-            log_file_path, mode="a", encoding="utf-8-sig", header=True, index=False
+        log_file_path = os.path.join(
+            data_directory, f"toll-rates-{today_date}.parquet"
         )
+        df_final.to_parquet(log_file_path, compression="zstd", index=False)
+        if export_csv:
+            df_final.to_csv(
+                os.path.join(data_directory, f"toll-rates-{today_date}.csv"),
+                mode="w",
+                encoding="utf-8-sig",
+                index=False,
+                chunksize=50_000,
+            )
         logging.info(f"Saved data to {log_file_path}")
 
 
-def get_latest_files(directory, file_pattern):
+def get_latest_files(directory, kind):
     """
-    Get the latest files from the directory based on the given pattern.
+    Get the latest files of the given kind from the directory.
 
     Args:
         directory (str): Directory path.
-        file_pattern (str): File name pattern.
+        kind (str): File kind ("toll" or "markers"), also the filename prefix.
 
     Returns:
-        list: List of the latest files.
+        tuple: Tuple of (kind, list of the latest files).
     """
     if not os.path.exists(directory):
         logging.error(f"The directory '{directory}' does not exist.")
         raise FileNotFoundError(f"The directory '{directory}' does not exist.")
 
-    files_with_timestamps = []
-    for file in glob.glob(os.path.join(directory, f"{file_pattern}*.csv")):
-        files_with_timestamps.append((file, os.path.getmtime(file)))
+    with os.scandir(directory) as entries:
+        files_with_timestamps = [
+            (entry.path, entry.stat(follow_symlinks=False).st_mtime)
+            for entry in entries
+            if entry.is_file()
+            and entry.name.startswith(kind)
+            and entry.name.endswith(".parquet")
+        ]
+
+    latest_files = [
+        file for file, _ in heapq.nlargest(2, files_with_timestamps, key=lambda x: x[1])
+    ]
+    logging.info(f"Latest files of kind '{kind}' are {latest_files}")
+    return kind, latest_files
+
+
+def diff_frames(previous_df, current_df, keys):
+    """
+    Compute the rows that differ between two snapshots of the same data.
+
+    Args:
+        previous_df (pandas.DataFrame): Previous snapshot.
+        current_df (pandas.DataFrame): Current snapshot.
+        keys (list): Key columns identifying a row across snapshots.
+
+    Returns:
+        pandas.DataFrame: Rows missing on either side or with changed values.
+    """
+    # outer merge on the key columns so added/removed rows show up too
+    merged = previous_df.merge(
+        current_df,
+        on=keys,
+        how="outer",
+        suffixes=("_previous", "_current"),
+        indicator=True,
+    )
+
+    # a row differs if it's missing on either side or any value column changed
+    changed = merged["_merge"] != "both"
+    for column in previous_df.columns:
+        if column in keys:
+            continue
+        previous_col = merged[f"{column}_previous"]
+        current_col = merged[f"{column}_current"]
+        changed |= (previous_col != current_col) & ~(
+            previous_col.isna() & current_col.isna()
+        )
+
+    return merged[changed]
 
-    files_with_timestamps.sort(key=lambda x: x[1], reverse=True)
 
-    latest_files = [file[0] for file in files_with_timestamps[:2]]
-    logging.info(f"Latest files matching pattern '{file_pattern}' are {latest_files}")
-    return latest_files
+def diff_partition(args):
+    """Unpack a (previous_df, current_df, keys) tuple for executor.map."""
+    previous_df, current_df, keys = args
+    return diff_frames(previous_df, current_df, keys)
 
 
-def comparison(previous_file_path, current_file_path):
+def comparison(kind, previous_file_path, current_file_path, today_date):
     """
-    Compare markers and toll data between previous and current data and save differences to CSV.
+    Compare markers and toll data between previous and current data and save
+    differences to Parquet (plus a CSV copy when EXPORT_CSV is set).
 
     Args:
+        kind (str): File kind ("toll" or "markers").
         previous_file_path (str): Path to the previous file.
         current_file_path (str): Path to the current file.
+        today_date (str): Date stamp (YYYY-MM-DD) for the difference file.
     """
-    if " toll" in previous_file_path or "toll" in current_file_path:
-        previous_df = pd.read_csv(previous_file_path)
-        current_df = pd.read_csv(current_file_path)
-        file = "toll"
+    keys = KIND_KEYS[kind]
+
+    previous_df = pd.read_parquet(previous_file_path)
+    current_df = pd.read_parquet(current_file_path)
+
+    if kind == "toll" and len(previous_df) >= PARALLEL_DIFF_MIN_ROWS:
+        # partition large toll frames by plaza and diff them across cores
+        previous_groups = dict(tuple(previous_df.groupby("plaza_name")))
+        current_groups = dict(tuple(current_df.groupby("plaza_name")))
+        empty_previous = previous_df.iloc[0:0]
+        empty_current = current_df.iloc[0:0]
+        partitions = [
+            (
+                previous_groups.get(plaza, empty_previous),
+                current_groups.get(plaza, empty_current),
+                keys,
+            )
+            for plaza in previous_groups.keys() | current_groups.keys()
+        ]
+        with ProcessPoolExecutor() as executor:
+            diffs = list(executor.map(diff_partition, partitions))
+        df_diff = pd.concat(diffs, ignore_index=True)
     else:
-        previous_df = pd.read_csv(previous_file_path, index_col="id")
-        current_df = pd.read_csv(current_file_path, index_col="id")
-        file = "markers"
+        df_diff = diff_frames(previous_df, current_df, keys)
 
-    if previous_df.shape == current_df.shape:
-        df_diff = previous_df.compare(current_df)
-        if len(df_diff) == 0:
-            print(f"No change in {file} data")
-            logging.info(f"No change in {file} data")
+    if len(df_diff) == 0:
+        print(f"No change in {kind} data")
+        logging.info(f"No change in {kind} data")
 
-        else:
-            # renaming columns to appropriate names
-            df_diff.columns = df_diff.columns.set_levels(
-                ["previous_df", "current_df"], level=1
+    else:
+        # saving the difference file
+        df_diff.to_parquet(f"{kind}-difference-{today_date}.parquet", index=False)
+        if export_csv:
+            df_diff.to_csv(
+                f"{kind}-difference-{today_date}.csv",
+                encoding="utf-8-sig",
+                index=False,
             )
+        logging.info(
+            f"Difference file saved to {kind}-difference-{today_date}.parquet"
+        )
+        print(" Difference found")
 
-            # flattening the multi-index
-            df_diff.columns = ["_".join(col).strip() for col in df_diff.columns.values]
-
-            # getting the current date and time
-            today_date = datetime.datetime.now().strftime("%Y-%m-%d")
-
-            # saving the difference file
-            df_diff.to_csv(f"{file}-difference-{today_date}.csv", encoding="utf-8-sig")
-            logging.info(f"Difference file saved to {file}-difference-{today_date}.csv")
-            print(" Difference found")
-
-    else: 
-        print("Previous and current data shapes are different. Can't Compare")
-        logging.info("Previous and current data shapes are different. Can't  Compare")
-    
     return
 
 
@@ -247,21 +405,46 @@ def main():
         if not os.path.exists(data_directory):
             os.makedirs(data_directory)
         
-        df = extract_plaza_info_from_kml(kml_path)
+        # Single date stamp shared by all artifacts of this run
+        today_date = datetime.date.today().isoformat()
+
+        df = extract_plaza_info_from_kml(kml_path, today_date)
         id_name, cat_dict = categ_dict(df, link)
-        get_data(df, id_name, cat_dict)
-        
+        get_data(df, id_name, cat_dict, today_date)
+
         # Get the latest toll data and markers files
-        latest_tolldata_files = get_latest_files(data_directory, "toll")
-        latest_markers_files = get_latest_files(data_directory, "markers")
-        
-        # Compare toll rates and markers between the latest files
-        comparison(latest_markers_files[1], latest_markers_files[0])
-        comparison(latest_tolldata_files[1], latest_tolldata_files[0])
+        toll_kind, latest_tolldata_files = get_latest_files(data_directory, "toll")
+        markers_kind, latest_markers_files = get_latest_files(
+            data_directory, "markers"
+        )
+
+        # Compare toll rates and markers between the latest files; the first
+        # run after the Parquet switch has only one snapshot of each kind
+        if len(latest_markers_files) < 2:
+            logging.info("Fewer than two markers snapshots; skipping comparison.")
+        else:
+            comparison(
+                markers_kind,
+                latest_markers_files[1],
+                latest_markers_files[0],
+                today_date,
+            )
+        if len(latest_tolldata_files) < 2:
+            logging.info("Fewer than two toll snapshots; skipping comparison.")
+        else:
+            comparison(
+                toll_kind,
+                latest_tolldata_files[1],
+                latest_tolldata_files[0],
+                today_date,
+            )
 
     except Exception as e:
         logging.error(f"Error in extraction and comparison: {e}")
         raise
+    finally:
+        # Flush queued records and release the log file
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()